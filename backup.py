@@ -0,0 +1,183 @@
+#!/bin/env python3
+
+import argparse
+import os
+import sqlite3
+from sys import exit
+from settings import CONFIG_FILE
+
+# The modules of each command are imported when the command runs,
+# so 'status' and 'history' only load the standard library and start fast
+
+MODES = ['delta', 'full']
+
+
+def connect_readonly(database_file):
+    """
+    Opens the database read-only, returns None if it does not exist yet.
+    """
+    if not os.path.exists(database_file):
+        print(f'Database {database_file} does not exist, no backup has been copied yet.')
+        return None
+    return sqlite3.connect(f'file:{database_file}?mode=ro', uri=True)
+
+
+def select_columns(conn, table, columns):
+    """
+    Returns the SQL list selecting columns from table, NULL for the columns missing
+    from databases created by the former scripts (added by 'plan' or 'copy').
+    """
+    c = conn.cursor()
+    c.execute(f'PRAGMA table_info({table})')
+    existing = [row[1] for row in c.fetchall()]
+    missing = [column for column in columns if column not in existing]
+    if missing:
+        print(f"Database not upgraded yet ({table} has no {', '.join(missing)}), run 'plan' or 'copy' once to upgrade it.")
+    return ', '.join(column if column in existing else f'NULL AS {column}' for column in columns)
+
+
+def status(args):
+    """
+    Prints the pending backup jobs and the files copied by the latest run.
+    """
+    from settings import database_file
+    from backup_plan import format_duration, format_size
+    conn = connect_readonly(database_file)
+    if conn is None:
+        return 1
+    c = conn.cursor()
+    c.execute(f'''
+        SELECT {select_columns(conn, 'api', ['jobid', 'jobname', 'server', 'timestamp'])} FROM api
+        WHERE copied = 0
+        ORDER BY id
+    ''')
+    rows = c.fetchall()
+    print(f'Pending jobs: {len(rows)}')
+    for jobid, jobname, server, timestamp in rows:
+        print(f'  {timestamp} {jobname} ({jobid}) from {server or "default server"}')
+    c.execute('SELECT MAX(timestamp) FROM backup_log')
+    last = c.fetchone()[0]
+    if last is None:
+        print('No file copied yet.')
+        conn.close()
+        return 0
+    c.execute(f'''
+        SELECT {select_columns(conn, 'backup_log', ['timestamp', 'destination_path', 'size', 'duration'])} FROM backup_log
+        WHERE timestamp >= DATETIME(?, '-1 day')
+        ORDER BY id
+    ''', (last,))
+    rows = c.fetchall()
+    conn.close()
+    total_size = sum(row[2] or 0 for row in rows)
+    duration = sum(row[3] or 0 for row in rows)
+    print(f'Copied in the 24 hours before {last} (UTC): {len(rows)} files, {format_size(total_size)} in {format_duration(duration)}')
+    for timestamp, destination_path, size, _ in rows:
+        print(f'  {timestamp} {destination_path} ({format_size(size or 0)})')
+    return 0
+
+
+def history(args):
+    """
+    Prints the latest copied files, optionally of a single job.
+    """
+    from settings import database_file
+    from backup_plan import format_size
+    conn = connect_readonly(database_file)
+    if conn is None:
+        return 1
+    c = conn.cursor()
+    columns = select_columns(conn, 'backup_log', ['timestamp', 'jobid', 'destination_path', 'size', 'hash_md5'])
+    if args.jobid:
+        c.execute(f'''
+            SELECT {columns} FROM backup_log
+            WHERE jobid = ?
+            ORDER BY id DESC
+            LIMIT ?
+        ''', (args.jobid, args.limit))
+    else:
+        c.execute(f'''
+            SELECT {columns} FROM backup_log
+            ORDER BY id DESC
+            LIMIT ?
+        ''', (args.limit,))
+    for timestamp, jobid, destination_path, size, hash_md5 in c.fetchall():
+        print(f'{timestamp} {jobid or "-"} {destination_path} ({format_size(size or 0)}) md5 {hash_md5}')
+    conn.close()
+    return 0
+
+
+def plan(args):
+    from backup_engine import run_copy
+    return run_copy(args.mode, args.config, plan=True)
+
+
+def copy(args):
+    from backup_engine import run_copy
+    return run_copy(args.mode, args.config, show_progress=args.progress)
+
+
+def verify(args):
+    from backup_engine import run_verify
+    return run_verify(args.mode, args.verify_mode, args.samples, args.repair)
+
+
+def restore(args):
+    from backup_engine import restore_copy
+    return restore_copy(args.filename, args.destination_directory, args.progress)
+
+
+def benchmark(args):
+    from backup_engine import usb_devices_authorized
+    from gocryptfs_bench import benchmark_profiles
+    usb_device = usb_devices_authorized()
+    if usb_device is None:
+        print('No authorized USB device connected.')
+        return 1
+    return benchmark_profiles(usb_device, args.profile, args.size * 1024 * 1024)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Copies the XO backups to an encrypted USB drive.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_status = subparsers.add_parser('status', help='Shows the pending jobs and the files copied by the latest run.')
+    parser_status.set_defaults(func=status)
+
+    parser_history = subparsers.add_parser('history', help='Shows the latest copied files.')
+    parser_history.add_argument('--limit', type=int, default=20, help='Number of files to show.')
+    parser_history.add_argument('--jobid', help='Only shows the files of this job.')
+    parser_history.set_defaults(func=history)
+
+    for name, func, help in [
+        ('plan', plan, 'Shows the files to copy, the space needed and the estimated time, without copying.'),
+        ('copy', copy, 'Copies the pending backups.'),
+        ('verify', verify, 'Verifies the copies against the block hashes recorded at copy time.')
+    ]:
+        subparser = subparsers.add_parser(name, help=help)
+        subparser.add_argument('--mode', nargs='+', choices=MODES, default=MODES, help='Modes to handle (default: all).')
+        subparser.set_defaults(func=func)
+        if name == 'verify':
+            subparser.add_argument('verify_mode', nargs='?', choices=['sample', 'full'], default='sample', help='Checks random blocks (sample, default) or all the blocks (full).')
+            subparser.add_argument('--samples', type=int, default=16, help='Number of blocks checked per file in sample mode.')
+            subparser.add_argument('--repair', action='store_true', help='Copies again the corrupted ranges.')
+        else:
+            subparser.add_argument('--config', default=CONFIG_FILE, help='XO servers configuration file.')
+        if name == 'copy':
+            subparser.add_argument('--progress', action='store_true', help='Shows the progress bar during copy.')
+
+    parser_restore = subparsers.add_parser('restore', help='Restores a copied file from the USB drive.')
+    parser_restore.add_argument('filename', help='Name of the copied file, or its path on the USB drive.')
+    parser_restore.add_argument('destination_directory', help='Directory where the file is restored.')
+    parser_restore.add_argument('--progress', action='store_true', help='Shows the progress bar during the restore.')
+    parser_restore.set_defaults(func=restore)
+
+    parser_benchmark = subparsers.add_parser('benchmark', help='Benchmarks the gocryptfs mount profiles on the USB drive.')
+    parser_benchmark.add_argument('--profile', nargs='+', help='Profiles to benchmark (default: all, see GOCRYPTFS_PROFILES).')
+    parser_benchmark.add_argument('--size', type=int, default=256, help='Size of the test file in MiB.')
+    parser_benchmark.set_defaults(func=benchmark)
+    return parser
+
+
+if __name__ == '__main__':
+    args = build_parser().parse_args()
+    exit(args.func(args))
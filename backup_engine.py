@@ -0,0 +1,988 @@
+#!/bin/env python3
+
+import json
+import os
+import re
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from shutil import disk_usage
+from sys import exit
+import sqlite3
+import hashlib
+import argparse
+from backup_plan import add_throughput_columns, encrypted_size, get_throughput, print_plan
+from merkle import copy_file_hashed, create_merkle_table, log_merkle, verify_copies
+from vhd_chain import XO_BASE_DELTA, create_chain_table, get_copied_uuids, is_differencing, log_chain
+from xo_servers import add_server_column, fetch_all_logs, get_server, load_servers
+from settings import (
+    AUTHORIZED_DEVICES, CONFIG_FILE, CRYPT_EXTPASS, CRYPT_MOUNTPOINT, CRYPT_PASSFILE, CRYPT_PASSWORD,
+    DESTINATION_DIRECTORY, GOCRYPTFS_PATH, GOCRYPTFS_PROFILE, GOCRYPTFS_PROFILES, SOURCE_DIRECTORY,
+    database_file, host, key_filename, username, xo_password, xo_username
+)
+
+# The heavy dependencies (paramiko, psutil, tqdm) are imported by the functions
+# using them, so the read-only commands of backup.py start fast
+
+
+def create_database():
+    conn = sqlite3.connect(database_file)
+    c = conn.cursor()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS api (
+              id INTEGER PRIMARY KEY,
+              jobid TEXT,
+              jobname TEXT,
+              json TEXT,
+              copied INTEGER DEFAULT 0,
+              server TEXT,
+              timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS backup_log (
+              id INTEGER PRIMARY KEY,
+              jobid TEXT,
+              filename TEXT,
+              source_path TEXT,
+              destination_path TEXT,
+              hash_md5 TEXT,
+              size INTEGER,
+              duration REAL,
+              timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Databases created by the former copy_full.py have no jobid in backup_log
+    c.execute('PRAGMA table_info(backup_log)')
+    if 'jobid' not in [row[1] for row in c.fetchall()]:
+        c.execute('ALTER TABLE backup_log ADD COLUMN jobid TEXT')
+    # Indexes of the status and history queries
+    c.execute('CREATE INDEX IF NOT EXISTS api_copied ON api (copied)')
+    c.execute('CREATE INDEX IF NOT EXISTS backup_log_timestamp ON backup_log (timestamp)')
+    c.execute('CREATE INDEX IF NOT EXISTS backup_log_filename ON backup_log (filename)')
+    conn.commit()
+    add_throughput_columns(conn)
+    add_server_column(conn)
+    create_chain_table(conn)
+    create_merkle_table(conn)
+    conn.close()
+
+
+def usb_devices_authorized():
+    """
+    Returns the path of an authorized USB device connected to the system.
+    The function checks all devices in the '/dev' directory that match the pattern 'sd[a-z]+$', and uses the 'udevadm'
+    command to check if the device is USB and get its serial number. If the serial number is authorized, the function
+    returns the path of the device with a partition number of 1 (e.g. '/dev/sdq1').
+
+    Returns:
+        str: The path of an authorized USB device with a partition number of 1, or None if no authorized device is found.
+    """
+    # Use the module 'os' to list the devices in the '/dev' directory
+    devices = [d for d in os.listdir('/dev') if re.match(r'sd[a-z]+$', d)]
+    return_device = None
+    # For each device, use the 'udevadm' command to check if it is USB and get the serial
+    for dev in devices:
+        result = subprocess.run(
+            ['udevadm', 'info', '--query=all', '--name=/dev/' + dev],
+            capture_output=True,
+            text=True
+        )
+        info = result.stdout
+        # Check if the device is USB
+        if 'SYNO_DEV_DISKPORTTYPE=USB' in info:
+            serial = None
+            for line in info.splitlines():
+                # Get the serial number
+                if 'SYNO_ATTR_SERIAL=' in line:
+                    serial = line.split('=')[1]
+            # Check if the serial number is authorized
+            if serial in AUTHORIZED_DEVICES:
+                return_device = f'/dev/{dev}1'
+                break
+    return return_device
+
+
+def get_usb_mountpoint(usb_device):
+    """
+    Returns the mountpoint of a USB device, given its device path.
+
+    If the USB device is not already mounted, it will be mounted to '/tmp/usb'.
+
+    Args:
+        usb_device (str): The device path of the USB device.
+
+    Returns:
+        str: The mountpoint of the USB device.
+    """
+    import psutil
+    # Verify if the USB device is mounted with psutil
+    mountpoint = None
+    for part in psutil.disk_partitions():
+        if part.device == usb_device:
+            mountpoint = part.mountpoint
+            break
+    if mountpoint is None:
+        # if not mounted, mount it
+        mountpoint = '/tmp/usb'
+        os.makedirs(mountpoint, exist_ok=True)
+        subprocess.run(['/bin/mount', usb_device, mountpoint], check=True)
+    print(f'USB device {usb_device} mounted to {mountpoint}.')
+    return mountpoint
+
+
+def umount_usb(usb_device):
+    """
+    Unmounts a USB device if it is currently mounted.
+
+    Args:
+        usb_device (str): The path to the USB device.
+
+    Raises:
+        subprocess.CalledProcessError: If the unmount command fails.
+
+    Returns:
+        None
+    """
+    import psutil
+    # Verify if the USB device is mounted with psutil
+    mountpoint = None
+    for part in psutil.disk_partitions():
+        if part.device == usb_device:
+            mountpoint = part.mountpoint
+            break
+    if mountpoint is not None:
+        # if mounted, unmount it
+        subprocess.run(['/bin/umount', mountpoint], check=True)
+        print(f'USB device {usb_device} unmounted.')
+
+
+def mount_gocryptfs(source, target, password, profile=GOCRYPTFS_PROFILE):
+    """
+    Mounts a directory encrypted with gocryptfs.
+
+    The password is read by gocryptfs from CRYPT_PASSFILE or CRYPT_EXTPASS when set,
+    otherwise from its standard input. gocryptfs only returns once the filesystem is
+    mounted, so its exit status tells if the mount succeeded.
+
+    Args:
+        source (str): The path to the encrypted directory.
+        target (str): The path to the mount point.
+        password (str): The password to decrypt the directory.
+        profile (str): The name of the mount profile, see GOCRYPTFS_PROFILES.
+
+    Raises:
+        Exception: If gocryptfs fails to mount the directory.
+    """
+    if not os.path.exists(GOCRYPTFS_PATH):
+        print(f"ERROR: File {GOCRYPTFS_PATH} does not exist.")
+        exit(1)
+    command = [GOCRYPTFS_PATH] + GOCRYPTFS_PROFILES[profile]
+    password_input = None
+    if CRYPT_PASSFILE:
+        command += ['-passfile', CRYPT_PASSFILE]
+    elif CRYPT_EXTPASS:
+        command += ['-extpass', CRYPT_EXTPASS]
+    else:
+        password_input = (password + '\n').encode()
+    command += [source, target]
+    # The output goes to a file: a pipe would be kept open by the gocryptfs daemon
+    with tempfile.TemporaryFile() as output:
+        result = subprocess.run(command, input=password_input, stdout=output, stderr=subprocess.STDOUT)
+        output.seek(0)
+        message = output.read().decode('utf-8', 'replace').strip()
+    if result.returncode == 0:
+        print(f"Filesystem {target} mounted and ready.")
+    else:
+        raise Exception(f"Error mounting filesystem: {message}")
+
+
+def unmount_gocryptfs(target):
+    """
+    Unmounts a directory encrypted with gocryptfs.
+
+    Args:
+        target (str): The path to the mount point.
+    """
+    command = ['/bin/umount', target]
+    try:
+        subprocess.run(command, check=True)
+        print(f"Filesystem encrypted {target} unmounted.")
+    except subprocess.CalledProcessError:
+        print(f"Error unmounting filesystem {target}.")
+
+
+@contextmanager
+def usb_session(usb_device):
+    """
+    Mounts the USB drive for the duration of a with block, and unmounts it when leaving
+    it. A USB drive found mounted (e.g. by the Synology automount) is left mounted, the
+    unencrypted destination may be on it.
+
+    Args:
+        usb_device (str): The path to the USB device.
+
+    Yields:
+        str: The mount point of the USB drive.
+    """
+    import psutil
+    was_mounted = any(part.device == usb_device for part in psutil.disk_partitions())
+    mountpoint = get_usb_mountpoint(usb_device)
+    try:
+        yield mountpoint
+    finally:
+        if not was_mounted:
+            umount_usb(usb_device)
+
+
+@contextmanager
+def mount_session(usb_device, profile=GOCRYPTFS_PROFILE):
+    """
+    Mounts the USB drive and its encrypted directory for the duration of a with block,
+    and unmounts both when leaving it (the USB drive only if it was not mounted, see usb_session).
+
+    Args:
+        usb_device (str): The path to the USB device.
+        profile (str): The name of the gocryptfs mount profile, see GOCRYPTFS_PROFILES.
+
+    Yields:
+        str: The mount point of the encrypted directory.
+    """
+    with usb_session(usb_device) as mountpoint:
+        usb_sourcedir = os.path.join(mountpoint, 'backup')
+        os.makedirs(usb_sourcedir, exist_ok=True)
+        os.makedirs(CRYPT_MOUNTPOINT, exist_ok=True)
+        mount_gocryptfs(usb_sourcedir, CRYPT_MOUNTPOINT, CRYPT_PASSWORD, profile)
+        try:
+            yield CRYPT_MOUNTPOINT
+        finally:
+            unmount_gocryptfs(CRYPT_MOUNTPOINT)
+
+
+def is_today_success(entry, mode):
+    """
+    Returns True if a backup log is a successful backup of the given mode started today.
+    """
+    return (entry['data']['mode'] == mode) and (
+        datetime.fromtimestamp(entry['start'] // 1000).date() == datetime.today().date()
+    ) and (entry['status'] == 'success')
+
+
+class DeltaPolicy:
+    """
+    Copies the delta mode backups, full images and the differencing images extending
+    them, to the encrypted directory of the authorized USB drive.
+    """
+    mode = 'delta'
+    encrypted = True
+
+    def is_registered(self, c, entry):
+        # A delta job is copied again every day it runs
+        c.execute('''
+        SELECT * FROM api
+            WHERE jobid = ? AND jobname = ? AND DATE(timestamp) = DATE('now', 'localtime')
+        ''', (entry['jobId'], entry['jobName']))
+        return c.fetchone() is not None
+
+    def resolve(self, metadata, destination_directory, jobid):
+        """
+        Resolves the images of a delta mode backup job that have to be copied or re-copied.
+        Nothing is mounted: the decision only relies on the source directory and the database.
+
+        Full images are copied, and differencing images only when they extend a chain
+        whose parent has already been copied (or is copied by the same run). A delta
+        whose chain is broken is skipped until XO writes (or merges) a full image.
+
+        Args:
+            metadata (list): The (directory, filename, content) of the .json files of the job.
+            destination_directory (str): Path of the destination directory.
+            jobid (str): The jobid of the backup job to copy.
+
+        Returns:
+            list: dicts with the keys 'filename', 'vhd', 'source_path', 'log_source_path',
+            'destination_path', 'size', 'action' ('copy' or 'recopy'), 'uuid',
+            'parent_uuid' and 'differencing', ordered parents first.
+        """
+        images = []
+        copied_uuids = get_copied_uuids(database_file)
+        # VDI uuids a delta can extend: the VHDs already copied and the ones copied by this run
+        chain_ends = set(copied_uuids)
+        conn = sqlite3.connect(database_file)
+        # Walk the backups from the oldest (the .json files are named after their date),
+        # so the parents are resolved before their deltas
+        for directory, filename, content in sorted(metadata, key=lambda x: x[1]):
+            # Verify if the backup is delta type
+            if 'mode' not in content or content['mode'] != 'delta':
+                print(f'The backup for jobid {jobid} is not delta type.')
+                continue
+            # find the image files associated with the delta backup
+            for key, vhd in content.get('vhds', {}).items():
+                vdi = content.get('vdis', {}).get(key, {})
+                uuid = vdi.get('uuid')
+                # Already part of a copied chain, even if XO merged it since then
+                if uuid is not None and uuid in copied_uuids:
+                    continue
+                image_filepath = os.path.join(directory, vhd)
+                log_source_path = os.path.join(image_filepath, os.path.dirname(vhd))
+                destination_image_filepath = os.path.join(destination_directory, vhd)
+                size = os.path.getsize(image_filepath)
+                # Deternine if the image is FULL or Incremental
+                differencing = is_differencing(image_filepath, content, vhd, vdi)
+                parent_uuid = vdi.get('other_config', {}).get(XO_BASE_DELTA) if differencing else None
+                # Verify if the file has already been copied
+                c = conn.cursor()
+                c.execute('''
+                    SELECT hash_md5, size FROM backup_log
+                    WHERE jobid = ? AND filename = ? AND source_path = ? AND destination_path = ?
+                    ORDER BY id DESC
+                ''', (jobid, os.path.basename(vhd), log_source_path, destination_image_filepath))
+                row = c.fetchone()
+                if row is None:
+                    # A delta is only useful on top of its copied parent
+                    if differencing and (parent_uuid is None or parent_uuid not in chain_ends):
+                        print(f'Backup Image file {os.path.basename(vhd)} -> the chain is broken, waiting for a full backup.')
+                        continue
+                    action = 'copy'
+                # Verify if the file has been modified, the size is checked first to skip the MD5 when possible
+                elif (row[1] is not None and row[1] != size) or calculate_md5(image_filepath) != row[0]:
+                    action = 'recopy'
+                else:
+                    print(f'Backup Image file {os.path.basename(vhd)} -> {destination_image_filepath} already exists and is up to date.')
+                    if uuid is not None:
+                        chain_ends.add(uuid)
+                    continue
+                if uuid is not None:
+                    chain_ends.add(uuid)
+                images.append({
+                    'filename': os.path.basename(vhd),
+                    'vhd': vhd,
+                    'source_path': image_filepath,
+                    'log_source_path': log_source_path,
+                    'destination_path': destination_image_filepath,
+                    'size': size,
+                    'action': action,
+                    'uuid': uuid,
+                    'parent_uuid': parent_uuid,
+                    'differencing': differencing
+                })
+        # Close the database connection
+        conn.close()
+        return images
+
+    def copied(self, jobid, image):
+        if image['uuid'] is not None:
+            log_chain(
+                database_file,
+                jobid,
+                image['vhd'],
+                image['uuid'],
+                image['parent_uuid'],
+                image['differencing'],
+                image['destination_path']
+            )
+
+
+class FullPolicy:
+    """
+    Copies the image (XVA) of the full mode backups to DESTINATION_DIRECTORY.
+    """
+    mode = 'full'
+    encrypted = False
+
+    def is_registered(self, c, entry):
+        c.execute('''
+        SELECT * FROM api
+            WHERE jobid = ? AND jobname = ?
+        ''', (entry['jobId'], entry['jobName']))
+        return c.fetchone() is not None
+
+    def resolve(self, metadata, destination_directory, jobid):
+        """
+        Resolves the image of the latest full mode backup of the job in each directory
+        that has to be copied or re-copied.
+
+        Args:
+            metadata (list): The (directory, filename, content) of the .json files of the job.
+            destination_directory (str): Path of the destination directory.
+            jobid (str): The jobid of the backup job to copy.
+
+        Returns:
+            list: dicts with the keys 'filename', 'source_path', 'log_source_path',
+            'destination_path', 'size' and 'action' ('copy' or 'recopy').
+        """
+        # Only the latest backup of each directory (the .json files are named after their date)
+        latest = {}
+        for directory, filename, content in sorted(metadata, key=lambda x: x[1]):
+            latest[directory] = (filename, content)
+        images = []
+        conn = sqlite3.connect(database_file)
+        for directory, (filename, content) in latest.items():
+            if 'mode' not in content or content['mode'] != 'full':
+                print(f'The backup for jobid {jobid} is not full type.')
+                continue
+            base_name = os.path.splitext(filename)[0]
+            image_filename = None
+            for file in sorted(os.listdir(directory)):
+                if file.startswith(base_name) and (file.endswith('.vhd') or file.endswith('.xva')):
+                    image_filename = file
+                    break
+            if image_filename is None and 'xva' in content:
+                image_filename = content['xva']
+            if image_filename is None:
+                print(f'Image file not found for jobid {jobid}')
+                continue
+            image_filepath = os.path.join(directory, image_filename)
+            destination_image_filepath = os.path.join(destination_directory, image_filename)
+            size = os.path.getsize(image_filepath)
+            # Copies logged by the former copy_full.py have no jobid
+            c = conn.cursor()
+            c.execute('''
+                SELECT hash_md5, size FROM backup_log
+                WHERE filename = ? AND source_path = ? AND destination_path = ?
+                ORDER BY id DESC
+            ''', (image_filename, image_filepath, destination_image_filepath))
+            row = c.fetchone()
+            if row is None:
+                action = 'copy'
+            elif (row[1] is not None and row[1] != size) or calculate_md5(image_filepath) != row[0]:
+                action = 'recopy'
+            else:
+                print(f'Backup full file {image_filepath} -> {destination_image_filepath} already exists and is up to date.')
+                continue
+            images.append({
+                'filename': image_filename,
+                'source_path': image_filepath,
+                'log_source_path': image_filepath,
+                'destination_path': destination_image_filepath,
+                'size': size,
+                'action': action
+            })
+        conn.close()
+        return images
+
+    def copied(self, jobid, image):
+        pass
+
+
+# Mode policies, by mode name
+POLICIES = {
+    'delta': DeltaPolicy(),
+    'full': FullPolicy()
+}
+
+
+def get_api_info(servers, policies):
+    """
+    Gets the backup information from the XO servers and stores the backups of the
+    given mode policies in a SQLite database. The logs are fetched once for all the modes.
+
+    Args:
+        servers (list): The XO servers settings.
+        policies (list): The mode policies.
+    """
+    policy_by_mode = {policy.mode: policy for policy in policies}
+    conn = sqlite3.connect(database_file)
+    for server, backups in fetch_all_logs(servers):
+        if backups is None:
+            continue
+        for entry in backups.values():
+            policy = policy_by_mode.get(entry['data']['mode'])
+            # Get backups from today with status success
+            if policy is None or not is_today_success(entry, policy.mode):
+                continue
+            # Add registry on database if it does not exist
+            c = conn.cursor()
+            if not policy.is_registered(c, entry):
+                c.execute('''
+                    INSERT INTO api (jobid, jobname, json, copied, server)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (entry['jobId'], entry['jobName'], json.dumps(entry), False, server['name']))
+                conn.commit()
+    conn.close()
+
+
+def calculate_md5(file_path, show_progress=False):
+    """
+    Calculates the MD5 hash of a file.
+
+    Args:
+        file_path (str): The path to the file to hash.
+        show_progress (bool): Whether to show the progress bar or not.
+
+    Returns:
+        str: The MD5 hash of the file.
+    """
+    from tqdm import tqdm
+    hash_md5 = hashlib.md5()
+    file_size = os.path.getsize(file_path)
+    # Read the file in chunks to avoid memory issues
+    with open(file_path, 'rb') as f:
+        if show_progress:
+            progress = tqdm(
+                total=file_size,
+                unit='B',
+                unit_scale=True,
+                desc=f'Calculating MD5 ({os.path.basename(file_path)})'
+            )
+        else:
+            progress = None
+        while True:
+            chunk = f.read(4096)
+            if not chunk:
+                break
+            hash_md5.update(chunk)
+            if progress is not None:
+                progress.update(len(chunk))
+        if show_progress:
+            progress.close()
+    return hash_md5.hexdigest()
+
+
+def log_backup(jobid, filename, source_path, destination_path, hash_md5, size=None, duration=None):
+    """
+    Logs a backup operation to a SQLite database.
+
+    Args:
+        jobid (str): The jobid of the backup job.
+        filename (str): The name of the file being backed up.
+        source_path (str): The path to the file being backed up.
+        destination_path (str): The path to the backup destination.
+        hash_md5 (str): The MD5 hash of the file being backed up.
+        size (int): The size of the file in bytes.
+        duration (float): The time spent copying the file, in seconds.
+    """
+    conn = sqlite3.connect(database_file)
+    c = conn.cursor()
+    c.execute('''
+        INSERT INTO backup_log (jobid, filename, source_path, destination_path, hash_md5, size, duration)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (jobid, filename, source_path, destination_path, hash_md5, size, duration))
+    conn.commit()
+    conn.close()
+
+
+def copy_file(source_path, destination_path, show_progress=False):
+    """
+    Copies a file, optionally showing a progress bar.
+
+    Args:
+        source_path (str): The path to the file to copy.
+        destination_path (str): The path to the copy.
+        show_progress (bool): Whether to show the progress bar or not.
+
+    Returns:
+        tuple: The MD5 hash of the file and the hashes of its blocks (Merkle tree leaves).
+    """
+    if not show_progress:
+        return copy_file_hashed(source_path, destination_path)
+    from tqdm import tqdm
+    with tqdm(
+        total=os.path.getsize(source_path),
+        unit='B',
+        unit_scale=True,
+        desc=f'Copying ({os.path.basename(source_path)})'
+    ) as pbar:
+        return copy_file_hashed(source_path, destination_path, pbar)
+
+
+def scan_metadata(source_directories, jobids):
+    """
+    Walks each source directory once and collects the .json metadata files of the given jobs.
+
+    Args:
+        source_directories (list): Paths of the source directories (remotes).
+        jobids (set): The jobids to look for.
+
+    Returns:
+        dict: For each source directory, the (directory, filename, content) of the .json
+        files of each jobid found in it.
+    """
+    found = {}
+    for source_directory in source_directories:
+        found[source_directory] = {}
+        for root, dirs, files in os.walk(source_directory):
+            for filename in files:
+                if filename.endswith('.json'):
+                    with open(os.path.join(root, filename), 'r') as file:
+                        content = json.load(file)
+                    if isinstance(content, dict) and content.get('jobId') in jobids:
+                        found[source_directory].setdefault(content['jobId'], []).append((root, filename, content))
+    return found
+
+
+def resolve_pending(policies, servers, rows):
+    """
+    Resolves the images to copy for the pending backup jobs, with a single walk of the remotes.
+
+    A delta job is registered again every day it runs, so a job not copied for several
+    days has several pending rows: they are resolved once, as a single job.
+
+    Args:
+        policies (list): The mode policies.
+        servers (list): The XO servers settings.
+        rows (list): The rows of the api table not copied yet.
+
+    Returns:
+        list: (rows, policy, images) tuples of the jobs whose .json files were found,
+        rows being the pending rows of the job.
+    """
+    policy_by_mode = {policy.mode: policy for policy in policies}
+    jobs = {}
+    for row in rows:
+        policy = policy_by_mode.get(json.loads(row[3])['data']['mode'])
+        if policy is None:
+            continue
+        server = get_server(servers, row[5])
+        if server is None:
+            print(f'Server {row[5]} of jobid {row[1]} is not configured.')
+            continue
+        jobs.setdefault((policy.mode, server['name'], row[1]), ([], policy, server))[0].append(row)
+    remotes = []
+    for _, _, server in jobs.values():
+        remotes.extend(remote for remote in server['remotes'] if remote not in remotes)
+    metadata = scan_metadata(remotes, set(jobid for _, _, jobid in jobs))
+    resolved = []
+    for (_, _, jobid), (job_rows, policy, server) in jobs.items():
+        # The first remote of the server holding the .json files of the job is used
+        job_metadata = next((metadata[remote][jobid] for remote in server['remotes'] if jobid in metadata[remote]), None)
+        if job_metadata is None:
+            print(f'File .json for jobid {jobid} not found.')
+            continue
+        destination_directory = CRYPT_MOUNTPOINT if policy.encrypted else DESTINATION_DIRECTORY
+        resolved.append((job_rows, policy, policy.resolve(job_metadata, destination_directory, jobid)))
+    return resolved
+
+
+def needed_space(policy, images):
+    """
+    Returns the space the images take once copied to the destination of the policy.
+    """
+    if policy.encrypted:
+        return sum(encrypted_size(image['size']) for image in images)
+    return sum(image['size'] for image in images)
+
+
+def mark_copied(row_id):
+    conn = sqlite3.connect(database_file)
+    c = conn.cursor()
+    c.execute('''
+        UPDATE api
+        SET copied = 1
+        WHERE id = ?
+    ''', (row_id,))
+    conn.commit()
+    conn.close()
+
+
+def copy_jobs(policy, jobs, destination_directory, show_progress=False):
+    """
+    Copies the images of the jobs of a policy to its (mounted) destination directory,
+    after checking once the free space for all of them.
+
+    Args:
+        policy: The mode policy.
+        jobs (list): (rows, images) tuples of the jobs to copy.
+        destination_directory (str): Path of the destination directory.
+        show_progress (bool): Whether to show the progress bar or not.
+
+    Returns:
+        bool: True if all the jobs were copied, False otherwise.
+    """
+    total_size = needed_space(policy, [image for _, images in jobs for image in images])
+    free_space = disk_usage(destination_directory).free
+    if free_space < total_size:
+        print(f'Not enough space on {destination_directory}. Need {total_size} bytes, disk has {free_space} bytes.')
+        return False
+    for rows, images in jobs:
+        jobid = rows[0][1]
+        for image in images:
+            started = time.monotonic()
+            # Create directory if not exists on destination
+            os.makedirs(os.path.dirname(image['destination_path']), exist_ok=True)
+            hash_md5, leaves = copy_file(image['source_path'], image['destination_path'], show_progress)
+            log_backup(
+                jobid,
+                image['filename'],
+                image['log_source_path'],
+                image['destination_path'],
+                hash_md5,
+                image['size'],
+                time.monotonic() - started
+            )
+            log_merkle(database_file, image['source_path'], image['destination_path'], image['size'], leaves)
+            policy.copied(jobid, image)
+            if image['action'] == 'copy':
+                print(f"Copy {policy.mode} backup: {image['source_path']} -> {image['destination_path']}")
+            else:
+                print(f"Backup {policy.mode} file {image['source_path']} -> {image['destination_path']} has been modified.")
+        for row in rows:
+            mark_copied(row[0])
+    return True
+
+
+def copy_pending(resolved, policies, show_progress=False):
+    """
+    Copies the resolved jobs, mounting the encrypted directory once for the whole run.
+
+    Args:
+        resolved (list): (rows, policy, images) tuples, as returned by resolve_pending.
+        policies (list): The mode policies.
+        show_progress (bool): Whether to show the progress bar or not.
+
+    Returns:
+        bool: True if all the jobs were copied, False otherwise.
+    """
+    success = True
+    # The unencrypted destinations first, before the USB drive is touched
+    for policy in sorted(policies, key=lambda policy: policy.encrypted):
+        jobs = [(rows, images) for rows, job_policy, images in resolved if job_policy is policy]
+        # Jobs without anything new to copy do not need the destination
+        for rows, images in jobs:
+            if not images:
+                for row in rows:
+                    mark_copied(row[0])
+        jobs = [(rows, images) for rows, images in jobs if images]
+        if not jobs:
+            continue
+        if policy.encrypted:
+            # Verify if device authorized is connected
+            usb_device = usb_devices_authorized()
+            if usb_device is None:
+                print('No authorized USB device connected.')
+                success = False
+                continue
+            with mount_session(usb_device) as destination_directory:
+                success = copy_jobs(policy, jobs, destination_directory, show_progress) and success
+        elif not os.path.exists(DESTINATION_DIRECTORY):
+            print(f'Directory {DESTINATION_DIRECTORY} does not exist.')
+            success = False
+        else:
+            success = copy_jobs(policy, jobs, DESTINATION_DIRECTORY, show_progress) and success
+    return success
+
+
+def plan_pending(resolved, policies):
+    """
+    Prints the images the pending backup jobs would copy to each target drive, the
+    space they need and the estimated run time. The encrypted directory is not mounted.
+
+    Args:
+        resolved (list): (rows, policy, images) tuples, as returned by resolve_pending.
+        policies (list): The mode policies.
+
+    Returns:
+        bool: True if the images fit on their target drives, False otherwise.
+    """
+    fits = True
+    for policy in policies:
+        images = [image for _, job_policy, images in resolved if job_policy is policy for image in images]
+        if policy.encrypted:
+            usb_device = usb_devices_authorized()
+            if usb_device is None:
+                print('No authorized USB device connected.')
+                fits = False
+                continue
+            # The USB drive has to be mounted to read its free space, usb_session leaves it as it was found
+            with usb_session(usb_device) as mountpoint:
+                free_space = disk_usage(mountpoint).free
+            throughput = get_throughput(database_file, CRYPT_MOUNTPOINT)
+            fits = print_plan(usb_device, free_space, images, throughput, encrypted=True) and fits
+        elif not os.path.exists(DESTINATION_DIRECTORY):
+            print(f'Directory {DESTINATION_DIRECTORY} does not exist.')
+            fits = False
+        else:
+            free_space = disk_usage(DESTINATION_DIRECTORY).free
+            throughput = get_throughput(database_file, DESTINATION_DIRECTORY)
+            fits = print_plan(DESTINATION_DIRECTORY, free_space, images, throughput) and fits
+    return fits
+
+
+def verify_pending(policies, mode, samples, repair=False):
+    """
+    Verifies the copies of each policy destination against the Merkle trees recorded
+    at copy time, mounting the encrypted directory when needed.
+
+    Args:
+        policies (list): The mode policies.
+        mode (str): 'sample' to check random blocks of each file, 'full' to check all the blocks.
+        samples (int): The number of blocks checked per file in 'sample' mode.
+        repair (bool): Whether to copy again the corrupted ranges.
+
+    Returns:
+        bool: True if no corruption remains, False otherwise.
+    """
+    verified = True
+    # The unencrypted destinations first, before the USB drive is touched
+    for policy in sorted(policies, key=lambda policy: policy.encrypted):
+        if policy.encrypted:
+            usb_device = usb_devices_authorized()
+            if usb_device is None:
+                print('No authorized USB device connected.')
+                verified = False
+                continue
+            with mount_session(usb_device) as destination_directory:
+                verified = verify_copies(database_file, destination_directory, mode, samples, repair) and verified
+        elif not os.path.exists(DESTINATION_DIRECTORY):
+            print(f'Directory {DESTINATION_DIRECTORY} does not exist.')
+            verified = False
+        else:
+            verified = verify_copies(database_file, DESTINATION_DIRECTORY, mode, samples, repair) and verified
+    return verified
+
+
+def add_arguments(parser):
+    """
+    Adds the arguments shared by the entry points to an argument parser.
+    """
+    parser.add_argument('--progress', action='store_true', help='Shows the progress bar during copy.')
+    parser.add_argument('--config', default=CONFIG_FILE, help='XO servers configuration file.')
+    parser.add_argument('--plan', action='store_true', help='Shows the files to copy, the space needed and the estimated time, without copying.')
+    parser.add_argument('--verify', choices=['sample', 'full'], help='Verifies the copies instead of copying: random blocks (sample) or all the blocks (full).')
+    parser.add_argument('--samples', type=int, default=16, help='Number of blocks checked per file with --verify sample.')
+    parser.add_argument('--repair', action='store_true', help='Copies again the corrupted ranges found by --verify.')
+
+
+def run_copy(modes, config_file=CONFIG_FILE, plan=False, show_progress=False):
+    """
+    Copies the pending backups of the given modes: one fetch of the XO logs, one walk
+    of the remotes and one mount of the encrypted directory for all of them.
+
+    Args:
+        modes (list): The names of the modes to handle ('delta', 'full').
+        config_file (str): The XO servers configuration file.
+        plan (bool): If True, only prints what would be copied (see plan_pending).
+        show_progress (bool): Whether to show the progress bar or not.
+
+    Returns:
+        int: The exit status, 0 on success.
+    """
+    policies = [POLICIES[mode] for mode in modes]
+    servers = load_servers(config_file, {
+        'name': host,
+        'host': host,
+        'username': username,
+        'key_filename': key_filename,
+        'xo_username': xo_username,
+        'xo_password': xo_password,
+        'remotes': [SOURCE_DIRECTORY]
+    })
+    create_database()
+    get_api_info(servers, policies)
+    # Select all backups that are not copied
+    conn = sqlite3.connect(database_file)
+    c = conn.cursor()
+    c.execute('''
+        SELECT id, jobid, jobname, json, copied, server FROM api
+        WHERE copied = 0
+    ''')
+    rows = c.fetchall()
+    conn.close()
+    resolved = resolve_pending(policies, servers, rows)
+    if plan:
+        return 0 if plan_pending(resolved, policies) else 1
+    return 0 if copy_pending(resolved, policies, show_progress) else 1
+
+
+def run_verify(modes, mode, samples=16, repair=False):
+    """
+    Verifies the copies of the given modes, see verify_pending.
+
+    Returns:
+        int: The exit status, 0 if no corruption remains.
+    """
+    create_database()
+    return 0 if verify_pending([POLICIES[name] for name in modes], mode, samples, repair) else 1
+
+
+def restore_file(path, target, hash_md5, show_progress=False):
+    """
+    Copies back a file and checks its MD5 hash against the one recorded at copy time.
+    """
+    restored_md5, _ = copy_file(path, target, show_progress)
+    if restored_md5 != hash_md5:
+        print(f'MD5 of the restored file {target} does not match the copied file.')
+        return False
+    print(f'File {path} restored to {target}.')
+    return True
+
+
+def restore_copy(filename, destination_directory, show_progress=False):
+    """
+    Restores the latest copy of a file from the USB drive, mounting the encrypted
+    directory when needed.
+
+    Args:
+        filename (str): The name of the copied file, or its destination path when
+            several copied files have that name.
+        destination_directory (str): The directory where the file is restored.
+        show_progress (bool): Whether to show the progress bar or not.
+
+    Returns:
+        int: The exit status, 0 on success.
+    """
+    conn = sqlite3.connect(database_file)
+    c = conn.cursor()
+    # The latest copy of each destination path matching the argument
+    c.execute('''
+        SELECT destination_path, hash_md5 FROM backup_log
+        WHERE id IN (
+            SELECT MAX(id) FROM backup_log
+            WHERE filename = ? OR destination_path = ?
+            GROUP BY destination_path
+        )
+        ORDER BY destination_path
+    ''', (filename, filename))
+    rows = c.fetchall()
+    conn.close()
+    if not rows:
+        print(f'No copy found for {filename}.')
+        return 1
+    # The delta images are named after their date, the disks of a run share their name
+    rows = [row for row in rows if row[0] == filename] or rows
+    if len(rows) > 1:
+        print(f'Several copies are named {filename}, give the path of the one to restore:')
+        for destination_path, _ in rows:
+            print(f'  {destination_path}')
+        return 1
+    row = rows[0]
+    if not os.path.exists(destination_directory):
+        print(f'Destination directory {destination_directory} does not exist.')
+        return 1
+    target = os.path.join(destination_directory, os.path.basename(row[0]))
+    if os.path.exists(target):
+        print(f'File {target} already exists, restore to another directory.')
+        return 1
+    if not row[0].startswith(os.path.join(CRYPT_MOUNTPOINT, '')):
+        return 0 if restore_file(row[0], target, row[1], show_progress) else 1
+    usb_device = usb_devices_authorized()
+    if usb_device is None:
+        print('No authorized USB device connected.')
+        return 1
+    with mount_session(usb_device):
+        return 0 if restore_file(row[0], target, row[1], show_progress) else 1
+
+
+def main(modes, args):
+    """
+    Runs the engine for the given modes with the arguments of add_arguments.
+
+    Args:
+        modes (list): The names of the modes to handle ('delta', 'full').
+        args (argparse.Namespace): The parsed arguments.
+
+    Returns:
+        int: The exit status, 0 on success.
+    """
+    if args.verify:
+        return run_verify(modes, args.verify, args.samples, args.repair)
+    return run_copy(modes, args.config, args.plan, args.progress)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Copies the delta and full mode backups in one run.')
+    parser.add_argument('--mode', nargs='+', choices=list(POLICIES), default=list(POLICIES), help='Modes to copy (default: all).')
+    add_arguments(parser)
+    args = parser.parse_args()
+    exit(main(args.mode, args))
@@ -0,0 +1,128 @@
+#!/bin/env python3
+
+import os
+import sqlite3
+
+# Gocryptfs stores every file with an 18 bytes header and encrypts it in
+# 4096 bytes blocks, each one growing by 32 bytes (16 bytes nonce + 16 bytes tag)
+GOCRYPTFS_HEADER_SIZE = 18
+GOCRYPTFS_BLOCK_SIZE = 4096
+GOCRYPTFS_BLOCK_OVERHEAD = 32
+
+# Number of the latest copies used to estimate the throughput
+THROUGHPUT_SAMPLES = 20
+
+
+def add_throughput_columns(conn):
+    """
+    Adds the 'size' and 'duration' columns to the backup_log table of databases
+    created before the throughput was recorded.
+
+    Args:
+        conn (sqlite3.Connection): The connection to the database.
+    """
+    c = conn.cursor()
+    c.execute('PRAGMA table_info(backup_log)')
+    columns = [row[1] for row in c.fetchall()]
+    if 'size' not in columns:
+        c.execute('ALTER TABLE backup_log ADD COLUMN size INTEGER')
+    if 'duration' not in columns:
+        c.execute('ALTER TABLE backup_log ADD COLUMN duration REAL')
+    conn.commit()
+
+
+def get_throughput(database_file, destination_directory):
+    """
+    Returns the average throughput of the latest copies to a destination directory
+    logged in the database.
+
+    Args:
+        database_file (str): The path to the SQLite database file.
+        destination_directory (str): The path of the destination directory.
+
+    Returns:
+        float: The throughput in bytes per second, or None if no copy has been recorded yet.
+    """
+    prefix = os.path.join(destination_directory, '')
+    conn = sqlite3.connect(database_file)
+    c = conn.cursor()
+    c.execute('''
+        SELECT size, duration FROM backup_log
+        WHERE size > 0 AND duration > 0 AND SUBSTR(destination_path, 1, LENGTH(?)) = ?
+        ORDER BY id DESC
+        LIMIT ?
+    ''', (prefix, prefix, THROUGHPUT_SAMPLES))
+    rows = c.fetchall()
+    conn.close()
+    if not rows:
+        return None
+    return sum(row[0] for row in rows) / sum(row[1] for row in rows)
+
+
+def encrypted_size(size):
+    """
+    Returns the space a file takes on disk once encrypted with gocryptfs.
+
+    Args:
+        size (int): The size of the plain file in bytes.
+
+    Returns:
+        int: The size of the encrypted file in bytes.
+    """
+    if size == 0:
+        return 0
+    blocks = -(-size // GOCRYPTFS_BLOCK_SIZE)
+    return GOCRYPTFS_HEADER_SIZE + size + blocks * GOCRYPTFS_BLOCK_OVERHEAD
+
+
+def format_size(size):
+    """
+    Formats a number of bytes as a human readable string (e.g. '1.5 GiB').
+    """
+    for unit in ['B', 'KiB', 'MiB', 'GiB', 'TiB']:
+        if abs(size) < 1024 or unit == 'TiB':
+            return f'{size:.1f} {unit}' if unit != 'B' else f'{size} B'
+        size /= 1024
+
+
+def format_duration(seconds):
+    """
+    Formats a number of seconds as 'HH:MM:SS'.
+    """
+    seconds = int(round(seconds))
+    return f'{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}'
+
+
+def print_plan(target, free_space, images, throughput, encrypted=False):
+    """
+    Prints the files a run would copy to a target drive, the space they need and
+    the estimated run time.
+
+    Args:
+        target (str): The name of the target drive (device or directory).
+        free_space (int): The free space on the target drive in bytes.
+        images (list): The images to copy, as returned by the resolve functions.
+        throughput (float): The recorded throughput in bytes per second, or None.
+        encrypted (bool): Whether the target is encrypted with gocryptfs.
+
+    Returns:
+        bool: True if the images fit on the target drive, False otherwise.
+    """
+    total_size = sum(image['size'] for image in images)
+    if encrypted:
+        needed_space = sum(encrypted_size(image['size']) for image in images)
+    else:
+        needed_space = total_size
+    print(f'Plan for {target}:')
+    for image in images:
+        print(f"  [{image['action']}] {image['source_path']} ({format_size(image['size'])})")
+    print(f'  Files: {len(images)}, total: {format_size(total_size)}')
+    print(f'  Space needed: {format_size(needed_space)}, free: {format_size(free_space)}')
+    if throughput is None:
+        print('  Estimated time: unknown (no copy recorded yet)')
+    else:
+        print(f'  Estimated time: {format_duration(total_size / throughput)} at {format_size(throughput)}/s')
+    if needed_space > free_space:
+        print(f'  Not enough space on {target}. Need {needed_space} bytes, disk has {free_space} bytes.')
+        return False
+    return True
@@ -0,0 +1,104 @@
+#!/bin/env python3
+
+import argparse
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from sys import exit
+
+# Measures the startup time of the read-only commands of backup.py against a
+# database of ROWS copied files, and checks they do not import the heavy dependencies.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKUP = os.path.join(ROOT, 'backup.py')
+COMMANDS = [['--help'], ['status'], ['history']]
+HEAVY_MODULES = ['paramiko', 'psutil', 'tqdm']
+ROWS = 10000
+FILES_PER_NIGHT = 20
+
+# Runs backup.py in the interpreter and prints the heavy modules it imported
+IMPORTED_CHECK = '''
+import runpy, sys
+sys.argv = [{backup!r}] + {args!r}
+try:
+    runpy.run_path({backup!r}, run_name='__main__')
+except SystemExit:
+    pass
+print(','.join(m for m in {heavy!r} if m in sys.modules), file=sys.stderr)
+'''
+
+
+def create_database(directory):
+    """
+    Creates a database with ROWS copied files in directory.
+    """
+    sys.path.insert(0, ROOT)
+    import backup_engine
+    backup_engine.database_file = os.path.join(directory, 'backup_copy.db')
+    backup_engine.create_database()
+    conn = sqlite3.connect(backup_engine.database_file)
+    conn.executemany('''
+        INSERT INTO backup_log (jobid, filename, source_path, destination_path, hash_md5, size, duration)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [
+        (f'job{i % 50}', f'{i}.vhd', f'/source/{i}.vhd', f'/tmp/crypto/{i}.vhd', '0' * 32, 1024 ** 3, 60.0)
+        for i in range(ROWS)
+    ])
+    # FILES_PER_NIGHT files copied each night, the latest ones last night
+    conn.execute('''
+        UPDATE backup_log
+        SET timestamp = DATETIME('now', '-' || ((? - id) / ?) || ' days')
+    ''', (ROWS, FILES_PER_NIGHT))
+    conn.commit()
+    conn.close()
+
+
+def measure(command, directory, runs):
+    """
+    Returns the median wall time of a command, in milliseconds.
+    """
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run(command, cwd=directory, stdout=subprocess.DEVNULL, check=True)
+        times.append((time.perf_counter() - started) * 1000)
+    return statistics.median(times)
+
+
+def heavy_imports(args, directory):
+    """
+    Returns the heavy modules imported by backup.py with args.
+    """
+    code = IMPORTED_CHECK.format(backup=BACKUP, args=args, heavy=HEAVY_MODULES)
+    result = subprocess.run(
+        [sys.executable, '-c', code],
+        cwd=directory,
+        env=dict(os.environ, PYTHONPATH=ROOT),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True
+    )
+    return [m for m in result.stderr.strip().splitlines()[-1].split(',') if m] if result.stderr.strip() else []
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks the startup time of backup.py.')
+    parser.add_argument('--runs', type=int, default=10, help='Number of runs per command.')
+    parser.add_argument('--max-ms', type=float, help='Fails if a command takes longer (median).')
+    args = parser.parse_args()
+    failed = False
+    with tempfile.TemporaryDirectory() as directory:
+        create_database(directory)
+        # The interpreter startup, for reference
+        print(f"python -c pass: {measure([sys.executable, '-c', 'pass'], directory, args.runs):.1f} ms")
+        for command in COMMANDS:
+            median = measure([sys.executable, BACKUP] + command, directory, args.runs)
+            imported = heavy_imports(command, directory)
+            print(f"backup.py {' '.join(command)}: {median:.1f} ms" + (f" (imports {', '.join(imported)})" if imported else ''))
+            if imported or (args.max_ms is not None and median > args.max_ms):
+                failed = True
+    exit(1 if failed else 0)
@@ -0,0 +1,117 @@
+#!/bin/env python3
+
+import hashlib
+import os
+import time
+from backup_engine import mount_gocryptfs, unmount_gocryptfs, usb_session
+from backup_plan import format_size
+from settings import CRYPT_MOUNTPOINT, CRYPT_PASSWORD, GOCRYPTFS_PROFILES
+
+# The test file is written by blocks of the size used by the copies
+BENCH_BLOCK_SIZE = 1024 * 1024
+BENCH_FILENAME = 'gocryptfs_bench.tmp'
+
+
+def drop_caches():
+    """
+    Flushes and drops the page cache, so the reads of the benchmark come from the drive.
+    Needs root, does nothing otherwise.
+    """
+    os.sync()
+    try:
+        with open('/proc/sys/vm/drop_caches', 'w') as f:
+            f.write('3\n')
+    except OSError:
+        print('Could not drop the page cache, the reads may come from memory.')
+
+
+def benchmark_profile(encrypted_directory, profile, size):
+    """
+    Mounts the encrypted directory with a profile, then writes and reads back a test file.
+
+    Args:
+        encrypted_directory (str): The path to the encrypted directory.
+        profile (str): The name of the mount profile, see GOCRYPTFS_PROFILES.
+        size (int): The size of the test file in bytes.
+
+    Returns:
+        dict: The mount time in seconds ('mount'), the write and read throughputs in
+        bytes per second ('write', 'read'), and whether the data read back is the data written ('ok').
+    """
+    started = time.monotonic()
+    mount_gocryptfs(encrypted_directory, CRYPT_MOUNTPOINT, CRYPT_PASSWORD, profile)
+    mount_time = time.monotonic() - started
+    path = os.path.join(CRYPT_MOUNTPOINT, BENCH_FILENAME)
+    block = os.urandom(BENCH_BLOCK_SIZE)
+    blocks = max(1, size // BENCH_BLOCK_SIZE)
+    try:
+        written = hashlib.md5()
+        started = time.monotonic()
+        with open(path, 'wb') as f:
+            for _ in range(blocks):
+                f.write(block)
+                written.update(block)
+            f.flush()
+            os.fsync(f.fileno())
+        write_time = time.monotonic() - started
+        drop_caches()
+        read = hashlib.md5()
+        started = time.monotonic()
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(BENCH_BLOCK_SIZE)
+                if not chunk:
+                    break
+                read.update(chunk)
+        read_time = time.monotonic() - started
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+        unmount_gocryptfs(CRYPT_MOUNTPOINT)
+    total = blocks * BENCH_BLOCK_SIZE
+    return {
+        'mount': mount_time,
+        'write': total / write_time,
+        'read': total / read_time,
+        'ok': written.digest() == read.digest()
+    }
+
+
+def benchmark_profiles(usb_device, profiles=None, size=256 * 1024 * 1024):
+    """
+    Benchmarks the gocryptfs mount profiles on the USB drive and prints the fastest
+    profile whose data was read back intact.
+
+    Args:
+        usb_device (str): The path to the USB device.
+        profiles (list): The names of the profiles to benchmark, all of them if None.
+        size (int): The size of the test file in bytes.
+
+    Returns:
+        int: The exit status, 0 if a profile could be benchmarked.
+    """
+    profiles = profiles or list(GOCRYPTFS_PROFILES)
+    results = []
+    with usb_session(usb_device) as mountpoint:
+        encrypted_directory = os.path.join(mountpoint, 'backup')
+        os.makedirs(CRYPT_MOUNTPOINT, exist_ok=True)
+        for profile in profiles:
+            try:
+                results.append((profile, benchmark_profile(encrypted_directory, profile, size)))
+            except Exception as e:
+                print(f'Profile {profile} failed: {e}')
+    print(f'Test file: {format_size(max(1, size // BENCH_BLOCK_SIZE) * BENCH_BLOCK_SIZE)}')
+    for profile, result in results:
+        print(
+            f"  {profile}: mount {result['mount'] * 1000:.0f} ms, "
+            f"write {format_size(result['write'])}/s, read {format_size(result['read'])}/s"
+            + ('' if result['ok'] else ', DATA MISMATCH')
+        )
+    safe = [(profile, result) for profile, result in results if result['ok']]
+    if not safe:
+        print('No profile could be benchmarked.')
+        return 1
+    # The copies write to the drive and the verifications read from it
+    fastest = min(safe, key=lambda x: 1 / x[1]['write'] + 1 / x[1]['read'])[0]
+    print(f"Fastest profile: {fastest} (set GOCRYPTFS_PROFILE = '{fastest}' in settings.py)")
+    return 0
@@ -0,0 +1,288 @@
+#!/bin/env python3
+
+import hashlib
+import os
+import random
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+# Size of the blocks hashed as leaves of the Merkle tree
+BLOCK_SIZE = 1024 * 1024
+DIGEST_SIZE = 16
+
+# Number of files verified at the same time
+VERIFY_WORKERS = 4
+
+
+def create_merkle_table(conn):
+    """
+    Creates the table storing the Merkle tree of each copied file.
+    The leaves are the concatenated hashes of the BLOCK_SIZE blocks of the file.
+
+    Args:
+        conn (sqlite3.Connection): The connection to the database.
+    """
+    c = conn.cursor()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS merkle (
+              id INTEGER PRIMARY KEY,
+              source_path TEXT,
+              destination_path TEXT,
+              size INTEGER,
+              block_size INTEGER,
+              root TEXT,
+              leaves BLOB,
+              timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+
+
+def hash_block(data):
+    """
+    Returns the hash of a block of data.
+    """
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest()
+
+
+def merkle_root(leaves):
+    """
+    Computes the root of the Merkle tree built on top of the given leaves.
+
+    Args:
+        leaves (list): The hashes of the blocks of a file.
+
+    Returns:
+        str: The root hash, in hexadecimal.
+    """
+    level = list(leaves)
+    if not level:
+        return hash_block(b'').hex()
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        level = [hash_block(level[i] + level[i + 1]) for i in range(0, len(level), 2)]
+    return level[0].hex()
+
+
+def copy_file_hashed(source_path, destination_path, progress=None):
+    """
+    Copies a file, computing its MD5 hash and the leaves of its Merkle tree while
+    reading it, so the source is read only once.
+
+    Args:
+        source_path (str): The path to the file to copy.
+        destination_path (str): The path to the copy.
+        progress (tqdm): A progress bar to update, or None.
+
+    Returns:
+        tuple: The MD5 hash of the file and the list of its block hashes.
+    """
+    hash_md5 = hashlib.md5()
+    leaves = []
+    with open(source_path, 'rb') as source_file, open(destination_path, 'wb') as file:
+        while True:
+            chunk = source_file.read(BLOCK_SIZE)
+            if not chunk:
+                break
+            file.write(chunk)
+            hash_md5.update(chunk)
+            leaves.append(hash_block(chunk))
+            if progress is not None:
+                progress.update(len(chunk))
+    return hash_md5.hexdigest(), leaves
+
+
+def log_merkle(database_file, source_path, destination_path, size, leaves):
+    """
+    Records the Merkle tree of a copied file.
+
+    Args:
+        database_file (str): The path to the SQLite database file.
+        source_path (str): The path to the copied file.
+        destination_path (str): The path to the copy.
+        size (int): The size of the file in bytes.
+        leaves (list): The hashes of the blocks of the file.
+    """
+    conn = sqlite3.connect(database_file)
+    c = conn.cursor()
+    c.execute('''
+        INSERT INTO merkle (source_path, destination_path, size, block_size, root, leaves)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (source_path, destination_path, size, BLOCK_SIZE, merkle_root(leaves), b''.join(leaves)))
+    conn.commit()
+    conn.close()
+
+
+def get_merkle_records(database_file, destination_directory):
+    """
+    Returns the latest Merkle tree of each file copied to destination_directory.
+
+    Args:
+        database_file (str): The path to the SQLite database file.
+        destination_directory (str): The path of the destination directory.
+
+    Returns:
+        list: dicts with the keys 'source_path', 'destination_path', 'size', 'block_size', 'root' and 'leaves'.
+    """
+    prefix = os.path.join(destination_directory, '')
+    conn = sqlite3.connect(database_file)
+    c = conn.cursor()
+    c.execute('''
+        SELECT source_path, destination_path, size, block_size, root, leaves FROM merkle
+        WHERE id IN (SELECT MAX(id) FROM merkle GROUP BY destination_path)
+        ORDER BY destination_path
+    ''')
+    records = []
+    for row in c.fetchall():
+        if not row[1].startswith(prefix):
+            continue
+        records.append({
+            'source_path': row[0],
+            'destination_path': row[1],
+            'size': row[2],
+            'block_size': row[3],
+            'root': row[4],
+            'leaves': [row[5][i:i + DIGEST_SIZE] for i in range(0, len(row[5]), DIGEST_SIZE)]
+        })
+    conn.close()
+    return records
+
+
+def blocks_to_ranges(blocks, block_size, size):
+    """
+    Merges sorted block indexes into (offset, length) byte ranges.
+    """
+    ranges = []
+    for block in blocks:
+        offset = block * block_size
+        length = min(block_size, size - offset)
+        if ranges and ranges[-1][0] + ranges[-1][1] == offset:
+            ranges[-1] = (ranges[-1][0], ranges[-1][1] + length)
+        else:
+            ranges.append((offset, length))
+    return ranges
+
+
+def verify_file(record, mode='sample', samples=16):
+    """
+    Verifies a copied file against its Merkle tree.
+
+    Args:
+        record (dict): The Merkle tree of the file, as returned by get_merkle_records.
+        mode (str): 'sample' to check samples random blocks, 'full' to check all the blocks.
+        samples (int): The number of blocks checked in 'sample' mode.
+
+    Returns:
+        list: The corrupted (offset, length) ranges, empty if no corruption was found.
+    """
+    path = record['destination_path']
+    size = record['size']
+    block_size = record['block_size']
+    leaves = record['leaves']
+    if not os.path.exists(path):
+        return [(0, size)] if size else []
+    bad_blocks = set()
+    actual_size = os.path.getsize(path)
+    if actual_size != size:
+        bad_blocks.update(range(min(actual_size, size) // block_size, len(leaves)))
+    with open(path, 'rb') as f:
+        if mode == 'full':
+            actual_leaves = []
+            while True:
+                chunk = f.read(block_size)
+                if not chunk:
+                    break
+                actual_leaves.append(hash_block(chunk))
+            if actual_size == size and merkle_root(actual_leaves) == record['root']:
+                return []
+            bad_blocks.update(
+                i for i, leaf in enumerate(leaves)
+                if i >= len(actual_leaves) or actual_leaves[i] != leaf
+            )
+        else:
+            for i in random.sample(range(len(leaves)), min(samples, len(leaves))):
+                f.seek(i * block_size)
+                if hash_block(f.read(block_size)) != leaves[i]:
+                    bad_blocks.add(i)
+    ranges = blocks_to_ranges(sorted(bad_blocks), block_size, size)
+    # The bytes past the recorded size are not covered by any leaf
+    if actual_size > size:
+        ranges.append((size, actual_size - size))
+    return ranges
+
+
+def repair_file(record, ranges):
+    """
+    Copies again the corrupted ranges of a file from its source. The source blocks
+    are checked against the Merkle tree first, a source modified since the copy is
+    not used.
+
+    Args:
+        record (dict): The Merkle tree of the file, as returned by get_merkle_records.
+        ranges (list): The corrupted (offset, length) ranges.
+
+    Returns:
+        bool: True if the ranges were copied again, False otherwise.
+    """
+    block_size = record['block_size']
+    leaves = record['leaves']
+    destination_path = record['destination_path']
+    if not os.path.exists(record['source_path']):
+        print(f"Source file {record['source_path']} does not exist anymore.")
+        return False
+    # A missing directory means the destination drive is not mounted
+    if not os.path.isdir(os.path.dirname(destination_path)):
+        print(f'Directory {os.path.dirname(destination_path)} does not exist.')
+        return False
+    mode = 'r+b' if os.path.exists(destination_path) else 'wb'
+    with open(record['source_path'], 'rb') as source_file, open(destination_path, mode) as file:
+        for offset, length in ranges:
+            # The bytes past the recorded size are removed by the truncate
+            length = min(length, record['size'] - offset)
+            if length <= 0:
+                continue
+            source_file.seek(offset)
+            for block in range(offset // block_size, (offset + length - 1) // block_size + 1):
+                chunk = source_file.read(block_size)
+                if hash_block(chunk) != leaves[block]:
+                    print(f"Source file {record['source_path']} has been modified since the copy.")
+                    return False
+                file.seek(block * block_size)
+                file.write(chunk)
+        file.truncate(record['size'])
+    return True
+
+
+def verify_copies(database_file, destination_directory, mode='sample', samples=16, repair=False):
+    """
+    Verifies the files copied to destination_directory, several files at the same time,
+    and optionally copies again the corrupted ranges.
+
+    Args:
+        database_file (str): The path to the SQLite database file.
+        destination_directory (str): The path of the (mounted) destination directory.
+        mode (str): 'sample' to check random blocks of each file, 'full' to check all the blocks.
+        samples (int): The number of blocks checked per file in 'sample' mode.
+        repair (bool): Whether to copy again the corrupted ranges.
+
+    Returns:
+        bool: True if no corruption remains, False otherwise.
+    """
+    records = get_merkle_records(database_file, destination_directory)
+    with ThreadPoolExecutor(max_workers=VERIFY_WORKERS) as executor:
+        results = list(executor.map(lambda record: verify_file(record, mode, samples), records))
+    verified = True
+    for record, ranges in zip(records, results):
+        if not ranges:
+            continue
+        corrupted = sum(length for _, length in ranges)
+        print(f"Corrupted file {record['destination_path']}: {corrupted} bytes in {len(ranges)} ranges.")
+        for offset, length in ranges:
+            print(f'  offset {offset}, length {length}')
+        if repair and repair_file(record, ranges):
+            print(f"Corrupted ranges of {record['destination_path']} copied again.")
+        else:
+            verified = False
+    print(f'Verified {len(records)} files ({mode}).')
+    return verified
@@ -0,0 +1,46 @@
+#!/bin/env python3
+
+# Settings of the backup copy, shared by backup_engine.py and backup.py
+
+# SQLite database settings
+database_file = 'backup_copy.db' # Path to the database file
+
+# Devices authorized to copy backups
+AUTHORIZED_DEVICES = [
+    '0000' # Serial number of the USB drive
+]
+
+# XO servers configuration file, the settings below are used if it does not exist
+CONFIG_FILE = 'backup_copy.json'
+
+# XO Server SSH connection settings
+host = '192.168.1.10'           # IP address of the XO server
+username = 'username'           # SSH username
+key_filename = './ssh/id_rsa'   # SSH private key
+# XO credentials
+xo_username = 'admin@admin.net' # XO username (admin)
+xo_password = 'xxxxxxxxx'       # XO password
+
+# Gocryptfs settings
+GOCRYPTFS_PATH = '/volume1/backup/scripts/bin/gocryptfs'
+CRYPT_PASSWORD = 'xxxxxxxxxxxxxxxxxxxxx' # Password, given to gocryptfs on its standard input
+CRYPT_PASSFILE = None                    # Or a file containing the password (-passfile)
+CRYPT_EXTPASS = None                     # Or a command printing the password (-extpass)
+CRYPT_MOUNTPOINT = '/tmp/crypto'
+
+# Gocryptfs mount profiles: options added to the mount command
+GOCRYPTFS_PROFILES = {
+    'default': [],
+    # No preallocation of the file blocks, faster writes on slow file systems
+    'noprealloc': ['-noprealloc'],
+    # One read at a time, avoids the seeks of parallel reads on hard drives
+    'hdd': ['-noprealloc', '-serialize_reads'],
+    # Kernel page cache kept between opens, safe as long as nothing else writes to the drive
+    'cached': ['-noprealloc', '-kernel_cache']
+}
+GOCRYPTFS_PROFILE = 'default' # Profile used to mount the USB drive
+
+# Directory of the XO backups
+SOURCE_DIRECTORY = '/volume1/backup/xo-vm-backups'
+# Directory receiving the full mode backups (not encrypted)
+DESTINATION_DIRECTORY = '/volumeUSB1/usbshare/backup'
@@ -0,0 +1,129 @@
+#!/bin/env python3
+
+import os
+import sqlite3
+
+# VHD footer (https://learn.microsoft.com/en-us/windows/win32/vstor/about-vhd):
+# 512 bytes, starting with the 'conectix' cookie, with the disk type at offset 60.
+# Dynamic and differencing disks keep a copy of the footer at the start of the file.
+VHD_FOOTER_SIZE = 512
+VHD_COOKIE = b'conectix'
+VHD_DISK_TYPE_DIFFERENCING = 4
+
+# Key of the parent VDI snapshot in the VDI other_config of a delta backup
+XO_BASE_DELTA = 'xo:base_delta'
+
+
+def create_chain_table(conn):
+    """
+    Creates the table recording the delta chains of the copied VHDs.
+
+    Args:
+        conn (sqlite3.Connection): The connection to the database.
+    """
+    c = conn.cursor()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS vhd_chain (
+              id INTEGER PRIMARY KEY,
+              jobid TEXT,
+              chain TEXT,
+              vhd TEXT,
+              uuid TEXT,
+              parent_uuid TEXT,
+              differencing INTEGER,
+              destination_path TEXT,
+              timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+
+
+def read_vhd_disk_type(file_path):
+    """
+    Reads the disk type from the footer of a VHD file.
+
+    Args:
+        file_path (str): The path to the VHD file.
+
+    Returns:
+        int: The disk type (2 fixed, 3 dynamic, 4 differencing), or None if the
+        file is not a readable VHD file.
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            footer = f.read(VHD_FOOTER_SIZE)
+            if not footer.startswith(VHD_COOKIE):
+                # Fixed disks only have the footer at the end of the file
+                f.seek(-VHD_FOOTER_SIZE, 2)
+                footer = f.read(VHD_FOOTER_SIZE)
+    except OSError:
+        return None
+    if len(footer) < VHD_FOOTER_SIZE or not footer.startswith(VHD_COOKIE):
+        return None
+    return int.from_bytes(footer[60:64], 'big')
+
+
+def is_differencing(image_filepath, content, vhd, vdi):
+    """
+    Determines if the image of a delta backup is a differencing VHD.
+
+    The VHD footer is used first: XO merges the oldest deltas of a chain into full
+    images, so the metadata can describe as differencing a file that is not anymore.
+    The metadata is used when the footer can not be read.
+
+    Args:
+        image_filepath (str): The path to the VHD file.
+        content (dict): The content of the .json metadata file of the backup.
+        vhd (str): The path of the VHD, relative to the metadata file.
+        vdi (dict): The VDI of the VHD in the metadata.
+
+    Returns:
+        bool: True if the image is differencing, False if it is a full image.
+    """
+    disk_type = read_vhd_disk_type(image_filepath)
+    if disk_type is not None:
+        return disk_type == VHD_DISK_TYPE_DIFFERENCING
+    if vhd in content.get('isVhdDifferencing', {}):
+        return bool(content['isVhdDifferencing'][vhd])
+    return bool(vdi.get('other_config', {}))
+
+
+def get_copied_uuids(database_file):
+    """
+    Returns the VDI uuids of the VHDs already copied, i.e. the ends a delta can extend.
+
+    Args:
+        database_file (str): The path to the SQLite database file.
+
+    Returns:
+        set: The uuids of the copied VHDs.
+    """
+    conn = sqlite3.connect(database_file)
+    c = conn.cursor()
+    c.execute('SELECT uuid FROM vhd_chain')
+    uuids = set(row[0] for row in c.fetchall())
+    conn.close()
+    return uuids
+
+
+def log_chain(database_file, jobid, vhd, uuid, parent_uuid, differencing, destination_path):
+    """
+    Records a copied VHD and its parent in the vhd_chain table.
+
+    Args:
+        database_file (str): The path to the SQLite database file.
+        jobid (str): The jobid of the backup job.
+        vhd (str): The path of the VHD, relative to the metadata file.
+        uuid (str): The uuid of the VDI snapshot of the VHD.
+        parent_uuid (str): The uuid of the parent VDI snapshot, None for a full image.
+        differencing (bool): Whether the VHD is differencing.
+        destination_path (str): The path of the copy.
+    """
+    conn = sqlite3.connect(database_file)
+    c = conn.cursor()
+    c.execute('''
+        INSERT INTO vhd_chain (jobid, chain, vhd, uuid, parent_uuid, differencing, destination_path)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (jobid, os.path.dirname(vhd), vhd, uuid, parent_uuid, differencing, destination_path))
+    conn.commit()
+    conn.close()
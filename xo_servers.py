@@ -0,0 +1,129 @@
+#!/bin/env python3
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Path of the XO CLI on the XO servers
+XO_CLI = '/opt/xen-orchestra/node_modules/.bin/xo-cli'
+
+
+def load_servers(config_file, default_server):
+    """
+    Loads the XO servers and their backup remotes from a JSON configuration file.
+
+    The file contains a 'servers' list, each server accepting the keys 'name', 'host',
+    'username', 'key_filename', 'xo_username', 'xo_password' and 'remotes' (the list of
+    directories holding its backups). Missing keys are taken from default_server.
+
+    Args:
+        config_file (str): The path to the configuration file.
+        default_server (dict): The server built from the settings of the script.
+
+    Raises:
+        ValueError: If the file has no server or two servers have the same name.
+
+    Returns:
+        list: The servers, or [default_server] if the configuration file does not exist.
+    """
+    if not os.path.exists(config_file):
+        return [default_server]
+    with open(config_file, 'r') as file:
+        config = json.load(file)
+    servers = []
+    for server in config.get('servers', []):
+        entry = dict(default_server)
+        entry['name'] = server.get('host', default_server['host'])
+        entry.update(server)
+        servers.append(entry)
+    if not servers:
+        raise ValueError(f'No server configured in {config_file}')
+    names = [server['name'] for server in servers]
+    if len(set(names)) != len(names):
+        raise ValueError(f'Server names must be unique in {config_file}')
+    return servers
+
+
+def get_server(servers, name):
+    """
+    Returns the server with the given name, or the first server if name is None
+    (jobs registered before several servers were supported).
+    """
+    if name is None:
+        return servers[0]
+    for server in servers:
+        if server['name'] == name:
+            return server
+    return None
+
+
+def fetch_logs(server):
+    """
+    Gets the backup logs of an XO server through its XO CLI.
+
+    Args:
+        server (dict): The server settings.
+
+    Returns:
+        dict: The backup logs, indexed by log id.
+    """
+    import paramiko
+    # Creates an SSH connection
+    ssh = paramiko.SSHClient()
+    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    ssh.connect(server['host'], username=server['username'], key_filename=server['key_filename'])
+    try:
+        # Register XO CLI
+        _, stdout, _ = ssh.exec_command(f'{XO_CLI} --register http://localhost "{server["xo_username"]}" "{server["xo_password"]}"')
+        stdout.channel.recv_exit_status()
+        # Get backups from XO CLI and export to output as JSON
+        _, stdout, _ = ssh.exec_command(f'{XO_CLI} backupNg.getAllLogs --json')
+        stdout.channel.recv_exit_status()
+        # Reads the output and converts it to a JSON object
+        backups = json.loads(stdout.read().decode().strip())
+        # Unregister XO CLI
+        _, stdout, _ = ssh.exec_command(f'{XO_CLI} --unregister')
+        stdout.channel.recv_exit_status()
+    finally:
+        # Closes the SSH connection
+        ssh.close()
+    return backups
+
+
+def fetch_all_logs(servers):
+    """
+    Gets the backup logs of all the XO servers concurrently, so the total time is
+    bounded by the slowest server. A failing server is reported and skipped.
+
+    Args:
+        servers (list): The servers settings.
+
+    Returns:
+        list: (server, backups) tuples, in the order of servers, backups being None
+        if the logs could not be fetched.
+    """
+    results = []
+    with ThreadPoolExecutor(max_workers=len(servers)) as executor:
+        futures = [(server, executor.submit(fetch_logs, server)) for server in servers]
+        for server, future in futures:
+            try:
+                results.append((server, future.result()))
+            except Exception as e:
+                print(f"Error getting backup logs from {server['name']} ({server['host']}): {e}")
+                results.append((server, None))
+    return results
+
+
+def add_server_column(conn):
+    """
+    Adds the 'server' column to the api table of databases created before
+    several XO servers were supported.
+
+    Args:
+        conn (sqlite3.Connection): The connection to the database.
+    """
+    c = conn.cursor()
+    c.execute('PRAGMA table_info(api)')
+    if 'server' not in [row[1] for row in c.fetchall()]:
+        c.execute('ALTER TABLE api ADD COLUMN server TEXT')
+    conn.commit()